@@ -1,8 +1,8 @@
 import os
-import json
 from typing import List, Union, Any
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator, AliasChoices
+import orjson
 
 class Settings(BaseSettings):
     # Xray Configuration
@@ -32,8 +32,8 @@ class Settings(BaseSettings):
             # Try to parse as JSON first (in case user provided ["url1", "url2"])
             if v.startswith("[") and v.endswith("]"):
                 try:
-                    return json.loads(v)
-                except json.JSONDecodeError:
+                    return orjson.loads(v)
+                except orjson.JSONDecodeError:
                     # If JSON fails (e.g. malformed), fall back to splitting by comma
                     pass
             
@@ -45,18 +45,22 @@ class Settings(BaseSettings):
     LATENCY_TEST_URL: str = Field(default="http://www.google.com/generate_204")
     BATCH_SIZE: int = Field(default=500)
     BASE_PORT: int = Field(default=20000)
+    BATCH_CONCURRENCY: int = Field(default=2) # Xray batches tested at once, each on its own port range
     TEST_TIMEOUT: int = Field(default=10)
     MAX_DELAY_MS: int = Field(default=8000)
+    MAX_CONCURRENT_PROBES: int = Field(default=256) # Proxy probes in flight across all batches
     
     # Caching
     CACHE_INTERVAL_SECONDS: int = Field(default=900) # 15 minutes
     SITE_CACHE_TTL_SECONDS: int = Field(default=3600) # 1 hour
+    CACHE_TOP_N: int = Field(default=0) # Keep only the N fastest servers; 0 keeps all
     
     # Redis
     REDIS_HOST: str = Field(default="localhost")
     REDIS_PORT: int = Field(default=6379)
     REDIS_DB: int = Field(default=0)
     REDIS_PASSWORD: str = Field(default="")
+    REDIS_SERIALIZER: str = Field(default="json") # "json" or "msgpack"
 
     # GeoIP
     GEOIP_DB_PATH: str = Field(default="Country.mmdb")
@@ -1,18 +1,23 @@
 #!/usr/bin/env python3
 import asyncio
-import base64
+import logging
+import logging.handlers
+import queue
 import sys
 from typing import List, Dict, Optional
 
 from fastapi import FastAPI, HTTPException, Query, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import uvicorn
 
 from core.config import settings
-from models.server import ServerResponse
+from models.server import Server, ServerResponse
 from service.xray_service import XrayService
 from service.subscription_service import SubscriptionService
 
+logger = logging.getLogger(__name__)
+
 # --- Service Initialization ---
 xray_service = XrayService(settings)
 subscription_service = SubscriptionService(settings, xray_service)
@@ -30,15 +35,53 @@ app.add_middleware(
     allow_methods=["GET"],
     allow_headers=["*"],
 )
+# Subscription payloads are plain/Base64 text and compress well
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+def configure_logging() -> logging.handlers.QueueListener:
+    """
+    Sends log records through a queue to a listener thread, so the event loop
+    only enqueues them and never blocks on writing to a slow stdout/stderr pipe.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    listener.start()
+    return listener
+
+log_listener: Optional[logging.handlers.QueueListener] = None
 
 @app.on_event("startup")
 async def startup_event():
+    global log_listener
+    log_listener = configure_logging()
     asyncio.create_task(subscription_service.start_periodic_update())
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await subscription_service.close()
+    if log_listener:
+        # Flushes whatever is still queued
+        log_listener.stop()
+
 @app.get("/health", summary="Check if the service is running")
 def health_check():
     return {"status": "ok"}
 
+def build_server_response(servers: List[Dict]) -> Response:
+    # Cached servers are produced internally, so skip re-validating them on every request
+    # and serialize straight to JSON bytes instead of going through jsonable_encoder
+    payload = ServerResponse.model_construct(
+        count=len(servers),
+        servers=[Server.model_construct(**s) for s in servers],
+    )
+    return Response(payload.model_dump_json(), media_type="application/json")
+
 async def get_top_servers_dep() -> List[Dict]:
     servers = await subscription_service.get_top_25()
     if servers is None:
@@ -48,7 +91,12 @@ async def get_top_servers_dep() -> List[Dict]:
         )
     return servers
 
-@app.get("/servers/live", summary="Get top 25 servers (live test)", response_model=ServerResponse)
+@app.get(
+    "/servers/live",
+    summary="Get top 25 servers (live test)",
+    response_model=None,
+    responses={200: {"model": ServerResponse}},
+)
 async def get_servers_live():
     if subscription_service.is_processing():
         raise HTTPException(status_code=429, detail="A test is already in progress.")
@@ -61,17 +109,20 @@ async def get_servers_live():
         
     if not top_servers:
         raise HTTPException(status_code=503, detail="No servers available or all tests failed.")
-    top_25 = top_servers[:25]
-    return {"count": len(top_25), "servers": top_25}
+    return build_server_response(top_servers[:25])
 
-@app.get("/cache", summary="Get cached top 25 servers", response_model=ServerResponse)
+@app.get(
+    "/cache",
+    summary="Get cached top 25 servers",
+    response_model=None,
+    responses={200: {"model": ServerResponse}},
+)
 async def get_cached_servers(cached_servers: List[Dict] = Depends(get_top_servers_dep)):
-    return {"count": len(cached_servers), "servers": cached_servers}
+    return build_server_response(cached_servers)
 
 @app.get("/cache/raw", summary="Get cached top 25 servers as raw subscription links")
 async def get_cached_raw(cached_servers: List[Dict] = Depends(get_top_servers_dep)):
-    raw_links = [s["raw_uri"] for s in cached_servers]
-    return Response("\n".join(raw_links), media_type="text/plain")
+    return Response(await subscription_service.get_top_25_raw(), media_type="text/plain")
 
 def filter_servers(servers: List[Dict], countries: Optional[str] = None) -> List[Dict]:
     if not countries:
@@ -84,11 +135,12 @@ async def get_cached_base64(
     country: Optional[str] = Query(None, description="Filter by country codes (e.g., US,DE)"),
     cached_servers: List[Dict] = Depends(get_top_servers_dep)
 ):
+    if not country:
+        # Unfiltered requests are served from the blob encoded at refresh time
+        return Response(await subscription_service.get_top_25_base64(), media_type="text/plain")
+
     filtered = filter_servers(cached_servers, country)
-    raw_links = [s["raw_uri"] for s in filtered]
-    combined = "\n".join(raw_links)
-    encoded = base64.b64encode(combined.encode()).decode()
-    return Response(encoded, media_type="text/plain")
+    return Response(SubscriptionService.encode_subscription(filtered), media_type="text/plain")
 
 @app.get("/cache/all/base64", summary="Get ALL cached servers as a Base64 subscription")
 async def get_cached_all_base64(
@@ -97,12 +149,12 @@ async def get_cached_all_base64(
     cached_all = await subscription_service.get_all_cached()
     if cached_all is None:
         raise HTTPException(status_code=503, detail="Cache not initialized.")
-    
+
+    if not country:
+        return Response(await subscription_service.get_all_base64(), media_type="text/plain")
+
     filtered = filter_servers(cached_all, country)
-    raw_links = [s["raw_uri"] for s in filtered]
-    combined = "\n".join(raw_links)
-    encoded = base64.b64encode(combined.encode()).decode()
-    return Response(encoded, media_type="text/plain")
+    return Response(SubscriptionService.encode_subscription(filtered), media_type="text/plain")
 
 @app.get(
     "/subscription/site-specific",
@@ -124,11 +176,8 @@ async def get_site_specific_subscription(
     if not successful_servers:
         raise HTTPException(status_code=404, detail=f"No servers could successfully access {url}.")
 
-    print(f"Found {len(successful_servers)} servers that can access {url}.")
-    raw_links = [s["raw_uri"] for s in successful_servers]
-    combined = "\n".join(raw_links)
-    encoded = base64.b64encode(combined.encode()).decode()
-    return Response(encoded, media_type="text/plain")
+    logger.info("Found %s servers that can access %s.", len(successful_servers), url)
+    return Response(SubscriptionService.encode_subscription(successful_servers), media_type="text/plain")
 
 if __name__ == "__main__":
     # Basic check
@@ -1,41 +1,125 @@
+import asyncio
+import ipaddress
+import logging
 import os
-import sys
+import socket
+import time
+import aiofiles
 import aiohttp
 import geoip2.database
-from typing import Optional, Tuple
+from string import ascii_uppercase
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ASCII A-Z -> regional indicator symbols, applied in one C-level pass
+_FLAG_TRANS = str.maketrans({c: chr(ord(c) + 127397) for c in ascii_uppercase})
 
 class GeoIPService:
-    def __init__(self, db_path: str = "Country.mmdb"):
+    DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+    # IPs rarely change country, so bulk lookups are reused across refresh cycles
+    COUNTRY_CACHE_TTL_SECONDS = 3600
+    DNS_CACHE_TTL_SECONDS = 3600
+    DNS_CONCURRENCY = 64
+
+    # Every two-letter code (a superset of ISO 3166-1 alpha-2) -> flag emoji
+    _FLAG_CACHE: Dict[str, str] = {
+        a + b: (a + b).translate(_FLAG_TRANS)
+        for a in ascii_uppercase for b in ascii_uppercase
+    }
+
+    def __init__(self, db_path: str = "Country.mmdb", session: Optional[aiohttp.ClientSession] = None):
         self.db_path = db_path
         self.reader: Optional[geoip2.database.Reader] = None
+        # An injected session is shared with its owner; otherwise one is created lazily
+        self._session = session
+        self._owns_session = session is None
         self.download_url = "https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-Country.mmdb"
+        self._country_cache: Dict[str, Tuple[float, Tuple[str, str]]] = {}
+        self._dns_cache: Dict[str, Tuple[float, str]] = {}
 
     async def initialize(self):
-        """Downloads the DB if missing and opens the reader."""
+        """Downloads the DB if missing and opens the reader. Later calls are no-ops."""
+        if self.reader is not None:
+            return
+
         if not os.path.exists(self.db_path):
-            print(f"GeoIP database not found at {self.db_path}. Downloading...")
+            logger.info("GeoIP database not found at %s. Downloading...", self.db_path)
             await self._download_db()
         
         try:
+            # The default MODE_AUTO already picks the mmap'd C extension (MODE_MMAP_EXT)
+            # when libmaxminddb is available; MODE_MEMORY would force the slower pure
+            # Python reader
             self.reader = geoip2.database.Reader(self.db_path)
-            print(f"GeoIP database loaded from {self.db_path}")
+            logger.info("GeoIP database loaded from %s", self.db_path)
         except Exception as e:
-            print(f"Failed to load GeoIP database: {e}", file=sys.stderr)
+            logger.error("Failed to load GeoIP database: %s", e)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, use_dns_cache=True)
+            )
+            self._owns_session = True
+        return self._session
 
     async def _download_db(self):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.download_url) as resp:
-                    resp.raise_for_status()
-                    with open(self.db_path, 'wb') as f:
-                        while True:
-                            chunk = await resp.content.read(1024*1024)
-                            if not chunk:
-                                break
-                            f.write(chunk)
-            print("GeoIP database download complete.")
+            session = self._get_session()
+            async with session.get(self.download_url) as resp:
+                resp.raise_for_status()
+                # Write through aiofiles so disk I/O doesn't stall the event loop
+                async with aiofiles.open(self.db_path, 'wb') as f:
+                    async for chunk in resp.content.iter_chunked(self.DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
+            logger.info("GeoIP database download complete.")
         except Exception as e:
-            print(f"Error downloading GeoIP database: {e}", file=sys.stderr)
+            logger.error("Error downloading GeoIP database: %s", e)
+
+    async def resolve_bulk(self, hosts: Iterable[str]) -> Dict[str, str]:
+        """
+        Resolves hostnames to IPv4 addresses concurrently, caching results for
+        DNS_CACHE_TTL_SECONDS. IP literals map to themselves; failed lookups are omitted.
+        """
+        now = time.monotonic()
+        ttl = self.DNS_CACHE_TTL_SECONDS
+        cache = {host: entry for host, entry in self._dns_cache.items() if now - entry[0] < ttl}
+
+        resolved: Dict[str, str] = {}
+        pending = []
+        for host in set(hosts):
+            if not host:
+                continue
+            if host in cache:
+                resolved[host] = cache[host][1]
+                continue
+            try:
+                ipaddress.ip_address(host)
+                resolved[host] = host
+            except ValueError:
+                pending.append(host)
+
+        if pending:
+            loop = asyncio.get_running_loop()
+            semaphore = asyncio.Semaphore(self.DNS_CONCURRENCY)
+
+            async def resolve_one(host: str) -> Optional[str]:
+                async with semaphore:
+                    try:
+                        infos = await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+                        return infos[0][4][0] if infos else None
+                    except (OSError, UnicodeError):
+                        return None
+
+            results = await asyncio.gather(*(resolve_one(h) for h in pending))
+            for host, ip in zip(pending, results):
+                if ip:
+                    cache[host] = (now, ip)
+                    resolved[host] = ip
+
+        self._dns_cache = cache
+        return resolved
 
     def get_country(self, ip: str) -> Tuple[str, str]:
         """Returns (country_code, flag_emoji). Defaults to ('UN', '🇺🇳')."""
@@ -53,10 +137,36 @@ class GeoIPService:
             # IP not found or invalid
             return "UN", "🇺🇳"
 
+    def get_countries_bulk(self, ips: List[str]) -> List[Tuple[str, str]]:
+        """Looks up many IPs at once, querying the DB only once per unique, uncached IP."""
+        if not self.reader:
+            return [("UN", "🇺🇳")] * len(ips)
+
+        now = time.monotonic()
+        ttl = self.COUNTRY_CACHE_TTL_SECONDS
+        cache = {ip: entry for ip, entry in self._country_cache.items() if now - entry[0] < ttl}
+        get_country = self.get_country
+
+        for ip in dict.fromkeys(ips):
+            if ip not in cache:
+                cache[ip] = (now, get_country(ip))
+
+        self._country_cache = cache
+        return [cache[ip][1] for ip in ips]
+
     def _get_flag_emoji(self, country_code: str) -> str:
         """Converts a 2-letter country code to a flag emoji."""
-        return "".join([chr(ord(c) + 127397) for c in country_code.upper()])
+        flag = self._FLAG_CACHE.get(country_code)
+        if flag is None:
+            flag = country_code.upper().translate(_FLAG_TRANS)
+        return flag
 
     def close(self):
         if self.reader:
             self.reader.close()
+
+    async def aclose(self):
+        """Closes the reader and the HTTP session, if this service created it."""
+        self.close()
+        if self._owns_session and self._session and not self._session.closed:
+            await self._session.close()
@@ -1,6 +1,10 @@
+import hashlib
+import logging
 import os
 import subprocess
-import sys
+from typing import Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
 
 class GitUploader:
     def __init__(self, repo_url: str, token: str, user_name: str, user_email: str, repo_dir: str, branch: str = "main"):
@@ -14,6 +18,8 @@ class GitUploader:
         self.user_email = user_email
         self.branch = branch
         self.repo_dir = repo_dir
+        # filename -> digest of the content last pushed for it
+        self._last_content_hash: Dict[str, str] = {}
 
     def _run_command(self, command: list, cwd: str = None):
         try:
@@ -29,30 +35,32 @@ class GitUploader:
         except subprocess.CalledProcessError as e:
             # Don't print the error if it's just a "nothing to commit" status
             if "nothing to commit" not in e.stderr:
-                print(f"Git command failed: {' '.join(command)}\nError: {e.stderr}", file=sys.stderr)
+                logger.error("Git command failed: %s\nError: %s", ' '.join(command), e.stderr)
             raise
 
     def setup_repo(self):
         """Clones the repo if it doesn't exist, or pulls if it does."""
         if not os.path.exists(self.repo_dir):
-            print(f"Cloning repository to {self.repo_dir}...")
+            logger.info("Cloning repository to %s...", self.repo_dir)
             # Ensure parent dir exists
             parent_dir = os.path.dirname(self.repo_dir)
             if parent_dir and not os.path.exists(parent_dir):
                 os.makedirs(parent_dir, exist_ok=True)
                 
-            self._run_command(["git", "clone", "-b", self.branch, "--single-branch", self.repo_url, self.repo_dir])
-            
-            # Configure user identity
-            self._run_command(["git", "config", "user.name", self.user_name], cwd=self.repo_dir)
-            self._run_command(["git", "config", "user.email", self.user_email], cwd=self.repo_dir)
+            # Configure user identity as part of the clone instead of separate `git config` calls
+            self._run_command([
+                "git", "clone", "-b", self.branch, "--single-branch",
+                "--config", f"user.name={self.user_name}",
+                "--config", f"user.email={self.user_email}",
+                self.repo_url, self.repo_dir,
+            ])
         else:
             # FIX: Pull latest changes (e.g., README updates) before doing anything else
             # We use --rebase to apply our local bot commits on top of remote changes
             try:
                 # Ensure it is a git repo
                 if not os.path.exists(os.path.join(self.repo_dir, ".git")):
-                    print(f"Warning: {self.repo_dir} exists but is not a git repository. Cleaning up...", file=sys.stderr)
+                    logger.warning("%s exists but is not a git repository. Cleaning up...", self.repo_dir)
                     import shutil
                     shutil.rmtree(self.repo_dir)
                     self.setup_repo()
@@ -60,40 +68,92 @@ class GitUploader:
 
                 self._run_command(["git", "pull", "--rebase", "origin", self.branch], cwd=self.repo_dir)
             except Exception as e:
-                print(f"Warning: Git pull failed, attempting to reset. Error: {e}", file=sys.stderr)
+                logger.warning("Git pull failed, attempting to reset. Error: %s", e)
                 # Fallback: If rebase fails, hard reset to match remote (be careful, this discards local unpushed changes)
                 try:
                     self._run_command(["git", "fetch", "origin", self.branch], cwd=self.repo_dir)
                     self._run_command(["git", "reset", "--hard", f"origin/{self.branch}"], cwd=self.repo_dir)
                 except Exception as reset_err:
-                     print(f"Critical: Git reset failed too. {reset_err}", file=sys.stderr)
-                     print(f"Deleting corrupted repository at {self.repo_dir} to start fresh.", file=sys.stderr)
+                     logger.critical("Git reset failed too. %s", reset_err)
+                     logger.error("Deleting corrupted repository at %s to start fresh.", self.repo_dir)
                      import shutil
                      if os.path.exists(self.repo_dir):
                          shutil.rmtree(self.repo_dir)
                      self.setup_repo()
 
-    def update_file_and_push(self, filename: str, content: str):
+    def _hash_sidecar_path(self, filename: str) -> str:
+        # Kept inside .git so the sidecar never shows up in `git status`
+        return os.path.join(self.repo_dir, ".git", "last_push_hashes", filename.replace(os.sep, "_"))
+
+    def _get_last_hash(self, filename: str) -> Optional[str]:
+        if filename in self._last_content_hash:
+            return self._last_content_hash[filename]
+        try:
+            with open(self._hash_sidecar_path(filename)) as f:
+                digest = f.read().strip()
+        except OSError:
+            return None
+        self._last_content_hash[filename] = digest
+        return digest
+
+    def _remember_hash(self, filename: str, digest: str):
+        self._last_content_hash[filename] = digest
+        try:
+            path = self._hash_sidecar_path(filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(digest)
+        except OSError as e:
+            logger.warning("could not persist push hash for %s: %s", filename, e)
+
+    @staticmethod
+    def _file_matches(file_path: str, data: bytes) -> bool:
+        try:
+            # Size check is a cheap pre-filter before reading the whole file
+            if os.path.getsize(file_path) != len(data):
+                return False
+            with open(file_path, "rb") as f:
+                return f.read() == data
+        except OSError:
+            return False
+
+    def update_file_and_push(self, filename: str, content: Union[str, bytes]):
+        data = content.encode() if isinstance(content, str) else content
+        digest = hashlib.blake2b(data).hexdigest()
+        if digest == self._get_last_hash(filename):
+            # Same content as the last successful push; skip the whole git round trip
+            logger.info("No changes to push for %s.", filename)
+            return
+
         try:
             self.setup_repo()
             
             file_path = os.path.join(self.repo_dir, filename)
-            
+
+            # Compare with the checked-out file first; an identical file needs neither
+            # a write nor a `git status` index scan
+            if self._file_matches(file_path, data):
+                logger.info("No changes to push for %s.", filename)
+                self._remember_hash(filename, digest)
+                return
+
             # Write content to file
-            with open(file_path, "w") as f:
-                f.write(content)
+            with open(file_path, "wb") as f:
+                f.write(data)
             
             # Check status
             status = self._run_command(["git", "status", "--porcelain"], cwd=self.repo_dir)
             if not status:
-                print(f"No changes to push for {filename}.")
+                logger.info("No changes to push for %s.", filename)
+                self._remember_hash(filename, digest)
                 return
 
-            print(f"Committing and pushing {filename}...")
+            logger.info("Committing and pushing %s...", filename)
             self._run_command(["git", "add", filename], cwd=self.repo_dir)
             self._run_command(["git", "commit", "-m", f"Auto-update {filename}"], cwd=self.repo_dir)
             self._run_command(["git", "push", "origin", self.branch], cwd=self.repo_dir)
-            print(f"Push successful for {filename}!")
+            logger.info("Push successful for %s!", filename)
+            self._remember_hash(filename, digest)
             
         except Exception as e:
-            print(f"Failed to push to GitHub: {e}", file=sys.stderr)
+            logger.error("Failed to push to GitHub: %s", e)
@@ -1,9 +1,121 @@
-import base64
 import binascii
-import json
-import sys
-from typing import Any, Dict, Optional
-from urllib.parse import urlparse, parse_qs
+import functools
+import logging
+import string
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+import orjson
+import pybase64
+
+# Per-URI diagnostics are debug-level so dirty feeds don't flood stderr
+logger = logging.getLogger(__name__)
+
+# Subscription feeds republish mostly the same URIs every refresh cycle
+_PARSE_CACHE_SIZE = 1 << 16
+
+# Query parameters each parser reads; anything else is skipped without decoding
+_VLESS_PARAMS = frozenset(("encryption", "security", "type", "host", "path", "sni", "flow", "fp", "pbk", "sid"))
+_TROJAN_PARAMS = frozenset(("sni", "peer", "security", "type", "flow", "path", "host"))
+_HY2_PARAMS = frozenset(("sni", "insecure", "obfs", "obfs-password"))
+
+# Every two-digit hex escape, in any letter case, mapped to the byte it encodes
+_HEX_TO_BYTE = {
+    (hi + lo).encode(): bytes.fromhex(hi + lo)
+    for hi in string.hexdigits
+    for lo in string.hexdigits
+}
+
+
+def _split_netloc(uri: str) -> Tuple[str, str, str]:
+    """
+    Splits ``scheme://netloc/path?query#fragment`` into (netloc, query, fragment)
+    with the same semantics as the matching ``urlparse`` attributes.
+    """
+    rest = uri[uri.index("://") + 3:]
+    rest, _, fragment = rest.partition("#")
+    rest, _, query = rest.partition("?")
+    netloc = rest.partition("/")[0]
+    if ("[" in netloc) != ("]" in netloc):
+        raise ValueError("Invalid IPv6 URL")
+    return netloc, query, fragment
+
+
+def _split_uri(uri: str) -> Tuple[Optional[str], Optional[str], Optional[int], str, str]:
+    """
+    Splits ``scheme://user@host:port/path?query#fragment`` in a single pass.
+    Returns (username, hostname, port, query, fragment) with the same semantics
+    as the matching ``urlparse`` attributes.
+    """
+    netloc, query, fragment = _split_netloc(uri)
+
+    userinfo, have_at, hostinfo = netloc.rpartition("@")
+    username = userinfo.partition(":")[0] if have_at else None
+
+    _, have_open_br, bracketed = hostinfo.partition("[")
+    if have_open_br:
+        hostname, _, port_str = bracketed.partition("]")
+        port_str = port_str.partition(":")[2]
+    else:
+        hostname, _, port_str = hostinfo.partition(":")
+
+    port = None
+    if port_str:
+        if not (port_str.isdigit() and port_str.isascii()):
+            raise ValueError(f"Port could not be cast to integer value as {port_str!r}")
+        port = int(port_str)
+        if not 0 <= port <= 65535:
+            raise ValueError("Port out of range 0-65535")
+
+    return username, hostname.lower() or None, port, query, fragment
+
+
+def _unquote(value: str) -> str:
+    """
+    Percent-decodes ``value`` with the same result as ``urllib.parse.unquote``,
+    using a table lookup per escape instead of a regex scan.
+    """
+    if "%" not in value:
+        return value
+    head, *tokens = value.encode().split(b"%")
+    out = bytearray(head)
+    for token in tokens:
+        byte = _HEX_TO_BYTE.get(token[:2])
+        if byte is None:
+            # Not a valid escape, keep it literally
+            out += b"%"
+            out += token
+        else:
+            out += byte
+            out += token[2:]
+    return out.decode("utf-8", "replace")
+
+
+def _parse_query(query: str, wanted: FrozenSet[str]) -> Dict[str, str]:
+    """
+    Parses a query string into a flat dict, keeping the first value per key.
+    Only keys in ``wanted`` are kept, so other values are never unquoted.
+    Blank values are dropped, matching ``parse_qs`` defaults.
+    """
+    params: Dict[str, str] = {}
+    if not query:
+        return params
+    for part in query.split("&"):
+        key, has_eq, value = part.partition("=")
+        if not has_eq or not value:
+            continue
+        if "+" in key:
+            key = key.replace("+", " ")
+        if "%" in key:
+            key = _unquote(key)
+        if key not in wanted or key in params:
+            continue
+        if "+" in value:
+            value = value.replace("+", " ")
+        if "%" in value:
+            value = _unquote(value)
+        params[key] = value
+    return params
+
 
 class ProxyParser:
     """
@@ -12,79 +124,77 @@ class ProxyParser:
     def parse(self, uri: str) -> Optional[Dict[str, Any]]:
         """
         Detects the protocol and parses the given URI.
+        Results are memoized per URI string; each call returns a fresh copy.
         """
-        if uri.startswith("vless://"):
-            return self._parse_vless_uri(uri)
-        elif uri.startswith("vmess://"):
-            return self._parse_vmess_uri(uri)
-        elif uri.startswith("trojan://"):
-            return self._parse_trojan_uri(uri)
-        elif uri.startswith("ss://"):
-            return self._parse_ss_uri(uri)
-        elif uri.startswith("hy2://"):
-            return self._parse_hy2_uri(uri)
-        elif uri.startswith("ssr://"):
-            # SSR is not supported by standard Xray core, skip quietly
-            return None
-        else:
-            print(f"Unsupported URI scheme: {uri}", file=sys.stderr)
-            return None
+        result = _parse_cached(uri)
+        return result.copy() if result else None
+
+    @classmethod
+    def _parse_uncached(cls, uri: str) -> Optional[Dict[str, Any]]:
+        # Slice out only the scheme; partition() would also copy the rest of the URI
+        end = uri.find("://")
+        if end > 0:
+            scheme = uri[:end]
+            if scheme in cls._HANDLERS:
+                handler = cls._HANDLERS[scheme]
+                return handler(uri) if handler else None
+
+        logger.debug("Unsupported URI scheme: %s", uri)
+        return None
 
     @staticmethod
     def _parse_vless_uri(uri: str) -> Optional[Dict[str, Any]]:
         """Parses a VLESS URI into a structured dictionary."""
         try:
-            parsed = urlparse(uri)
-            if not all([parsed.scheme == 'vless', parsed.username, parsed.hostname, parsed.port]):
-                print(f"Skipping malformed VLESS URI: {uri}", file=sys.stderr)
+            user, host, port, query, fragment = _split_uri(uri)
+            if not all([user, host, port]):
+                logger.debug("Skipping malformed VLESS URI: %s", uri)
                 return None
 
-            query_params = parse_qs(parsed.query)
+            params = _parse_query(query, _VLESS_PARAMS)
             return {
                 "protocol": "vless",
-                "remark": parsed.fragment or "",
-                "address": parsed.hostname,
-                "port": parsed.port,
-                "vless_id": parsed.username,
-                "encryption": query_params.get("encryption", ["none"])[0],
-                "security": query_params.get("security", ["none"])[0],
-                "type": query_params.get("type", ["tcp"])[0],
-                "host": query_params.get("host", [None])[0],
-                "path": query_params.get("path", [None])[0],
-                "sni": query_params.get("sni", [None])[0],
-                "flow": query_params.get("flow", [None])[0],
-                "fp": query_params.get("fp", [None])[0],
-                "pbk": query_params.get("pbk", [None])[0],
-                "sid": query_params.get("sid", [None])[0],
+                "remark": fragment,
+                "address": host,
+                "port": port,
+                "vless_id": user,
+                "encryption": params.get("encryption", "none"),
+                "security": params.get("security", "none"),
+                "type": params.get("type", "tcp"),
+                "host": params.get("host"),
+                "path": params.get("path"),
+                "sni": params.get("sni"),
+                "flow": params.get("flow"),
+                "fp": params.get("fp"),
+                "pbk": params.get("pbk"),
+                "sid": params.get("sid"),
                 "raw_uri": uri,
             }
         except (ValueError, AttributeError) as e:
-            print(f"Error parsing VLESS URI: {uri}. Error: {e}", file=sys.stderr)
+            logger.debug("Error parsing VLESS URI: %s. Error: %s", uri, e)
             return None
 
     @staticmethod
     def _parse_vmess_uri(uri: str) -> Optional[Dict[str, Any]]:
         """Parses a VMess URI into a structured dictionary."""
         try:
-            # 1. Strip protocol
-            encoded_part = uri.replace("vmess://", "")
-            
+            # 1. Strip protocol (parse() already dispatched on it)
             # 2. Strip query parameters (some aggregators add ?remarks=...)
-            if "?" in encoded_part:
-                encoded_part = encoded_part.split("?")[0]
-            
+            encoded_part = uri[len("vmess://"):].partition("?")[0]
+
             # 3. Clean whitespace
             encoded_part = encoded_part.strip()
             
             # 4. Robust Base64 Decoding
-            # Fix padding
-            padding_needed = 4 - (len(encoded_part) % 4)
-            if padding_needed and padding_needed != 4:
-                encoded_part += "=" * padding_needed
-                
+            # Work on bytes so b64decode skips its own str -> ASCII conversion,
+            # then fix padding
+            encoded_bytes = encoded_part.encode("ascii")
+            pad = -len(encoded_bytes) & 3
+            if pad:
+                encoded_bytes += b"=" * pad
+
             try:
-                decoded_bytes = base64.b64decode(encoded_part, validate=False)
-                decoded_json = decoded_bytes.decode("utf-8", errors="ignore")
+                decoded_bytes = pybase64.b64decode(encoded_bytes, validate=False)
             except (binascii.Error, ValueError):
                 # If standard decode fails, try to strip non-base64 chars from the end?
                 # or just fail. For now, let's assume padding fix is enough for most.
@@ -92,17 +202,28 @@ class ProxyParser:
 
             # 5. Handle "Extra data" (JSON followed by garbage)
             # Find the last '}'
-            last_brace_index = decoded_json.rfind("}")
+            last_brace_index = decoded_bytes.rfind(b"}")
             if last_brace_index != -1:
-                decoded_json = decoded_json[:last_brace_index+1]
-            
-            vmess_data = json.loads(decoded_json)
+                decoded_bytes = decoded_bytes[:last_brace_index+1]
+
+            # orjson parses the bytes directly, skipping the intermediate str
+            try:
+                vmess_data = orjson.loads(decoded_bytes)
+            except orjson.JSONDecodeError:
+                # orjson rejects invalid UTF-8; retry on a lossy decode
+                vmess_data = orjson.loads(decoded_bytes.decode("utf-8", errors="ignore"))
+            if not isinstance(vmess_data, dict):
+                return None
+
+            port = int(vmess_data.get("port", 0))
+            if not 0 <= port <= 65535:
+                raise ValueError("Port out of range 0-65535")
 
             return {
                 "protocol": "vmess",
                 "remark": vmess_data.get("ps", ""),
                 "address": vmess_data.get("add"),
-                "port": int(vmess_data.get("port", 0)),
+                "port": port,
                 "vmess_id": vmess_data.get("id"),
                 "security": vmess_data.get("scy", "auto"),
                 "type": vmess_data.get("net", "tcp"),
@@ -113,50 +234,47 @@ class ProxyParser:
                 "aid": vmess_data.get("aid", 0),
                 "raw_uri": uri,
             }
-        except (json.JSONDecodeError, binascii.Error, TypeError, ValueError) as e:
-            # Uncomment for debugging specific failing URIs
-            # print(f"Error parsing VMess URI: {uri[:50]}... Error: {e}", file=sys.stderr)
+        except (orjson.JSONDecodeError, binascii.Error, TypeError, ValueError) as e:
+            logger.debug("Error parsing VMess URI: %.50s... Error: %s", uri, e)
             return None
 
     @staticmethod
     def _parse_trojan_uri(uri: str) -> Optional[Dict[str, Any]]:
         """Parses a Trojan URI into a structured dictionary."""
         try:
-            parsed = urlparse(uri)
-            if not all([parsed.scheme == 'trojan', parsed.username, parsed.hostname, parsed.port]):
-                print(f"Skipping malformed Trojan URI: {uri}", file=sys.stderr)
+            user, host, port, query, fragment = _split_uri(uri)
+            if not all([user, host, port]):
+                logger.debug("Skipping malformed Trojan URI: %s", uri)
                 return None
 
-            query_params = parse_qs(parsed.query)
+            params = _parse_query(query, _TROJAN_PARAMS)
             return {
                 "protocol": "trojan",
-                "remark": parsed.fragment or "",
-                "address": parsed.hostname,
-                "port": parsed.port,
-                "password": parsed.username,
-                "sni": query_params.get("sni", [query_params.get("peer", [None])[0]])[0],
-                "security": query_params.get("security", ["tls"])[0],
-                "type": query_params.get("type", ["tcp"])[0],
-                "flow": query_params.get("flow", [None])[0],
-                "path": query_params.get("path", [None])[0],
-                "host": query_params.get("host", [None])[0],
+                "remark": fragment,
+                "address": host,
+                "port": port,
+                "password": user,
+                "sni": params.get("sni") or params.get("peer"),
+                "security": params.get("security", "tls"),
+                "type": params.get("type", "tcp"),
+                "flow": params.get("flow"),
+                "path": params.get("path"),
+                "host": params.get("host"),
                 "raw_uri": uri,
             }
         except (ValueError, AttributeError) as e:
-            print(f"Error parsing Trojan URI: {uri}. Error: {e}", file=sys.stderr)
+            logger.debug("Error parsing Trojan URI: %s. Error: %s", uri, e)
             return None
 
     @staticmethod
     def _parse_ss_uri(uri: str) -> Optional[Dict[str, Any]]:
         """Parses a Shadowsocks (SS) URI into a structured dictionary."""
         try:
-            parsed = urlparse(uri)
-            
+            netloc, _, fragment = _split_netloc(uri)
+
             # Helper to handle different SS formats
-            user_info_part = parsed.netloc
-            if '@' in user_info_part:
-                user_info_part, address_part = user_info_part.split('@', 1)
-            else:
+            user_info_part, has_at, address_part = netloc.partition('@')
+            if not has_at:
                  # Legacy SS format handling might go here, but for now assume standard
                  return None
 
@@ -165,27 +283,26 @@ class ProxyParser:
             if padding != 4:
                 user_info_part += '=' * padding
             
-            user_info_decoded = base64.urlsafe_b64decode(user_info_part).decode('utf-8')
+            user_info_decoded = pybase64.urlsafe_b64decode(user_info_part).decode('utf-8')
             
-            if ':' not in user_info_decoded:
+            method, has_colon, password = user_info_decoded.partition(':')
+            if not has_colon:
                 return None
-                
-            method, password = user_info_decoded.split(':', 1)
             
-            if ':' in address_part:
-                host, port_str = address_part.rsplit(':', 1)
-                port = int(port_str)
-            else:
+            host, has_colon, port_str = address_part.rpartition(':')
+            if not has_colon:
                 return None
+            port = int(port_str)
+            if not 0 <= port <= 65535:
+                raise ValueError("Port out of range 0-65535")
 
             # Safely decode the remark (fragment)
             remark = ""
-            if parsed.fragment:
+            if fragment:
                 try:
-                    from urllib.parse import unquote
-                    remark = unquote(parsed.fragment)
+                    remark = _unquote(fragment)
                 except Exception:
-                    remark = parsed.fragment
+                    remark = fragment
 
             return {
                 "protocol": "shadowsocks",
@@ -200,40 +317,51 @@ class ProxyParser:
             # Silently skip malformed SS links to avoid log noise
             return None
         except Exception as e:
-            # print(f"Error parsing Shadowsocks URI: {uri}. Error: {e}", file=sys.stderr)
+            logger.debug("Error parsing Shadowsocks URI: %s. Error: %s", uri, e)
             return None
 
     @staticmethod
     def _parse_hy2_uri(uri: str) -> Optional[Dict[str, Any]]:
         """Parses a Hysteria 2 URI into a structured dictionary."""
         try:
-            parsed = urlparse(uri)
-            if parsed.scheme != 'hy2':
-                return None
-
             # For hy2, the username part is used as the password/auth
-            auth = parsed.username
-            host = parsed.hostname
-            port = parsed.port
+            auth, host, port, query, fragment = _split_uri(uri)
 
             if not all([host, port, auth]):
-                print(f"Skipping malformed Hysteria 2 URI: {uri}", file=sys.stderr)
+                logger.debug("Skipping malformed Hysteria 2 URI: %s", uri)
                 return None
 
-            query_params = parse_qs(parsed.query)
-            
+            params = _parse_query(query, _HY2_PARAMS)
+
             return {
                 "protocol": "hysteria2",
-                "remark": parsed.fragment or "",
+                "remark": fragment,
                 "address": host,
                 "port": port,
                 "password": auth,
-                "sni": query_params.get("sni", [None])[0],
-                "insecure": query_params.get("insecure", ["0"])[0] == "1",
-                "obfs": query_params.get("obfs", [None])[0],
-                "obfs_password": query_params.get("obfs-password", [None])[0],
+                "sni": params.get("sni"),
+                "insecure": params.get("insecure", "0") == "1",
+                "obfs": params.get("obfs"),
+                "obfs_password": params.get("obfs-password"),
                 "raw_uri": uri,
             }
         except (ValueError, AttributeError) as e:
-            print(f"Error parsing Hysteria 2 URI: {uri}. Error: {e}", file=sys.stderr)
+            logger.debug("Error parsing Hysteria 2 URI: %s. Error: %s", uri, e)
             return None
+
+    # Scheme -> parser, resolved with a single dict lookup per URI.
+    # A None handler marks a scheme we recognise but deliberately skip.
+    _HANDLERS = {
+        "vless": _parse_vless_uri,
+        "vmess": _parse_vmess_uri,
+        "trojan": _parse_trojan_uri,
+        "ss": _parse_ss_uri,
+        "hy2": _parse_hy2_uri,
+        # SSR is not supported by standard Xray core, skip quietly
+        "ssr": None,
+    }
+
+
+@functools.lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def _parse_cached(uri: str) -> Optional[Dict[str, Any]]:
+    return ProxyParser._parse_uncached(uri)
@@ -1,14 +1,19 @@
-import json
-import sys
-from typing import Dict, List, Optional
+import logging
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import msgpack
+import orjson
 import redis.asyncio as redis
 
 from core.config import Settings
 
+logger = logging.getLogger(__name__)
+
 class StorageService:
     def __init__(self, settings: Settings):
         self.settings = settings
         self.redis: Optional[redis.Redis] = None
+        # Last packed value per field for each hash key, so saves only send changes
+        self._hash_state: Dict[str, Dict[str, bytes]] = {}
 
     async def initialize(self):
         """Initializes the Redis connection."""
@@ -18,41 +23,92 @@ class StorageService:
                 port=self.settings.REDIS_PORT,
                 db=self.settings.REDIS_DB,
                 password=self.settings.REDIS_PASSWORD or None,
-                decode_responses=True
+                # Payloads may be msgpack, so keep them as raw bytes
+                decode_responses=False
             )
             await self.redis.ping()
-            print(f"Connected to Redis at {self.settings.REDIS_HOST}:{self.settings.REDIS_PORT}")
+            logger.info("Connected to Redis at %s:%s", self.settings.REDIS_HOST, self.settings.REDIS_PORT)
         except Exception as e:
-            print(f"Failed to connect to Redis: {e}", file=sys.stderr)
+            logger.error("Failed to connect to Redis: %s", e)
             self.redis = None
 
-    async def save_servers(self, key: str, servers: List[Dict], ttl: int = 0):
-        """Saves a list of servers to Redis."""
+    async def load_servers(self, key: str) -> List[Dict]:
+        """Loads a list of servers from Redis."""
+        if not self.redis:
+            return []
+
+        try:
+            data = await self.redis.get(key)
+            if data:
+                return self._decode(data)
+        except Exception as e:
+            logger.error("Error loading from Redis (key=%s): %s", key, e)
+        return []
+
+    async def save_servers_hash(self, key: str, servers: List[Dict], fingerprint: Callable[[Dict], Hashable]):
+        """Saves servers into a Redis hash keyed by fingerprint, writing only changed fields."""
         if not self.redis:
             return
 
         try:
-            json_data = json.dumps(servers)
-            if ttl > 0:
-                await self.redis.setex(key, ttl, json_data)
-            else:
-                await self.redis.set(key, json_data)
+            fields = {str(fingerprint(s)): self._encode(s) for s in servers}
+            stored = await self._write_hash(key, fields, self._hash_state.get(key))
+            if stored != len(fields):
+                # Redis no longer holds what we last wrote (flushed, evicted, edited): rewrite it all
+                await self._write_hash(key, fields, None)
+            self._hash_state[key] = fields
         except Exception as e:
-            print(f"Error saving to Redis (key={key}): {e}", file=sys.stderr)
+            self._hash_state.pop(key, None)
+            logger.error("Error saving hash to Redis (key=%s): %s", key, e)
 
-    async def load_servers(self, key: str) -> List[Dict]:
-        """Loads a list of servers from Redis."""
+    async def _write_hash(self, key: str, fields: Dict[str, bytes], previous: Optional[Dict[str, bytes]]) -> int:
+        """Applies the difference from ``previous`` to the hash and returns its field count afterwards."""
+        pipe = self.redis.pipeline(transaction=False)
+        if previous is None:
+            # Nothing known about what's stored, so start clean
+            pipe.delete(key)
+            previous = {}
+        stale = [f for f in previous if f not in fields]
+        if stale:
+            pipe.hdel(key, *stale)
+        changed = {f: v for f, v in fields.items() if previous.get(f) != v}
+        if changed:
+            pipe.hset(key, mapping=changed)
+        pipe.hlen(key)
+        return (await pipe.execute())[-1]
+
+    async def load_servers_hash(self, key: str) -> List[Dict]:
+        """Loads all servers stored in a Redis hash."""
         if not self.redis:
             return []
 
         try:
-            data = await self.redis.get(key)
-            if data:
-                return json.loads(data)
+            if await self.redis.type(key) == b"string":
+                # Written by a version that stored the whole list as one value; the next
+                # save replaces it with a hash since nothing is known about its fields
+                self._hash_state.pop(key, None)
+                return await self.load_servers(key)
+
+            stored = await self.redis.hgetall(key)
+            # Remembering what's stored lets the next save send only the changes
+            self._hash_state[key] = {f.decode(): v for f, v in stored.items()}
+            return [self._decode(v) for v in stored.values()]
         except Exception as e:
-            print(f"Error loading from Redis (key={key}): {e}", file=sys.stderr)
+            logger.error("Error loading hash from Redis (key=%s): %s", key, e)
         return []
 
+    def _encode(self, value: Any) -> bytes:
+        if self.settings.REDIS_SERIALIZER == "msgpack":
+            return msgpack.packb(value, use_bin_type=True)
+        return orjson.dumps(value)
+
+    @staticmethod
+    def _decode(data: bytes) -> Any:
+        # Sniff the format so keys written before a serializer switch still load
+        if data[:1] in (b"[", b"{"):
+            return orjson.loads(data)
+        return msgpack.unpackb(data, raw=False)
+
     async def close(self):
         if self.redis:
             await self.redis.close()
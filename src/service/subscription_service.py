@@ -1,12 +1,15 @@
 import asyncio
-import base64
+import hashlib
+import heapq
+import logging
+import operator
 import os
-import sys
 import time
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 from urllib.parse import urlparse
 
 import aiohttp
+import pybase64
 
 from core.config import Settings
 from service.git_uploader import GitUploader
@@ -16,7 +19,19 @@ from service.geoip_service import GeoIPService
 from service.storage_service import StorageService
 from service.uri_generator import UriGenerator
 
+logger = logging.getLogger(__name__)
+
+
+def _stable_hash(fields: Tuple) -> int:
+    # hash() is salted per process (PYTHONHASHSEED); a 64-bit blake2b digest is not.
+    # repr() of str/int/None fields is deterministic and, unlike JSON encoding, can't fail
+    return int.from_bytes(hashlib.blake2b(repr(fields).encode(), digest_size=8).digest(), "little")
+
+
 class SubscriptionService:
+    # Bodies above this size are decoded and parsed in a worker thread
+    PARSE_OFFLOAD_BYTES = 256 * 1024
+
     def __init__(self, settings: Settings, xray_service: XrayService):
         self.settings = settings
         self.xray_service = xray_service
@@ -27,21 +42,59 @@ class SubscriptionService:
         # State
         self._cached_all: Optional[List[Dict]] = None
         self._cached_top25: Optional[List[Dict]] = None
+        # Pre-encoded subscriptions, rebuilt only when the cache changes
+        self._cached_raw: Optional[bytes] = None
+        self._cached_all_raw: Optional[bytes] = None
+        self._cached_b64: Optional[bytes] = None
+        self._cached_all_b64: Optional[bytes] = None
         self._cache_lock = asyncio.Lock()
         self._processing_lock = asyncio.Lock()
         
         self._site_cache: Dict[str, Tuple[float, List[Dict]]] = {}
         self._site_cache_lock = asyncio.Lock()
 
+        # Kept across refresh cycles so connections, DNS and TLS sessions are reused
+        self._session: Optional[aiohttp.ClientSession] = None
+        # One uploader for every push, so its record of pushed content survives between them
+        self._uploader: Optional[GitUploader] = None
+
+    @staticmethod
+    def join_raw_uris(servers: List[Dict]) -> bytes:
+        """Joins the servers' raw URIs into a newline-separated subscription body."""
+        return "\n".join(s["raw_uri"] for s in servers).encode()
+
+    @staticmethod
+    def encode_subscription(servers: List[Dict]) -> bytes:
+        """Joins the servers' raw URIs and Base64-encodes them as a subscription body."""
+        return pybase64.b64encode(SubscriptionService.join_raw_uris(servers))
+
+    def _set_cache(self, servers: List[Dict]):
+        """
+        Replaces the cached lists and their encoded forms. Caller must hold _cache_lock.
+
+        This never awaits, so readers on the event loop always see either the old or
+        the new set of values and can read them without taking the lock.
+        """
+        top25 = servers[:25]
+        self._cached_all = servers
+        self._cached_top25 = top25
+        self._cached_raw = self.join_raw_uris(top25)
+        self._cached_b64 = pybase64.b64encode(self._cached_raw)
+        self._cached_all_raw = self.join_raw_uris(servers)
+        self._cached_all_b64 = pybase64.b64encode(self._cached_all_raw)
+
     def _generate_fingerprint(self, server: Dict) -> int:
-        """Generates a unique hash for a server based on its connection details."""
+        """Generates a unique hash for a server based on its connection details.
+
+        The hash is stable across processes, so it can key persisted data.
+        """
         protocol = server.get("protocol")
         # Common fields for identity: address, port
         common = (server.get("address"), server.get("port"))
         
         if protocol == "vless":
             # Identity: protocol, address, port, uuid, flow, type, security, path
-            return hash((
+            return _stable_hash((
                 "vless", *common, 
                 server.get("vless_id"), 
                 server.get("flow"),
@@ -51,7 +104,7 @@ class SubscriptionService:
             ))
         elif protocol == "vmess":
              # Identity: protocol, address, port, uuid, type, security, path, tls, aid
-             return hash((
+             return _stable_hash((
                  "vmess", *common, 
                  server.get("vmess_id"), 
                  server.get("type"), 
@@ -62,170 +115,218 @@ class SubscriptionService:
              ))
         elif protocol == "trojan":
              # Identity: protocol, address, port, password
-             return hash(("trojan", *common, server.get("password")))
+             return _stable_hash(("trojan", *common, server.get("password")))
         elif protocol == "shadowsocks":
              # Identity: protocol, address, port, method, password
-             return hash(("shadowsocks", *common, server.get("method"), server.get("password")))
+             return _stable_hash(("shadowsocks", *common, server.get("method"), server.get("password")))
         elif protocol == "hysteria2":
              # Identity: protocol, address, port, password, obfs
-             return hash(("hysteria2", *common, server.get("password"), server.get("obfs")))
+             return _stable_hash(("hysteria2", *common, server.get("password"), server.get("obfs")))
         
         # Fallback for unknown protocols: use raw_uri (less optimal but safe)
-        return hash(server.get("raw_uri"))
+        return _stable_hash((server.get("raw_uri"),))
+
+    def _parse_subscription(self, raw: bytes) -> List[Dict]:
+        """Decodes a subscription body (Base64 or plaintext) and parses each line."""
+        try:
+            # Many feeds drop the trailing "=" padding. Line breaks don't count towards
+            # the Base64 length, so pad based on the body with whitespace removed
+            body = raw.translate(None, b" \t\r\n")
+            pad = -len(body) & 3
+            decoded_bytes = pybase64.b64decode(body + b"=" * pad if pad else body)
+            # A plaintext list "decodes" to noise once padded; keep the original then
+            if b"://" not in decoded_bytes[:4096]:
+                decoded_bytes = raw
+        except Exception:
+            decoded_bytes = raw
+        decoded = decoded_bytes.decode("utf-8", errors="ignore")
+
+        # One strip per line; a whole-body regex scan measured ~3x slower than splitlines
+        lines = [stripped for line in decoded.splitlines() if (stripped := line.strip())]
+        return [p for p in map(self.parser.parse, lines) if p]
 
     async def _fetch_single_url(self, session: aiohttp.ClientSession, url: str) -> List[Dict]:
-        url = url.strip()
-        if not url: return []
-        
-        print(f"Fetching from: {url}")
+        logger.info("Fetching from: %s", url)
         try:
-            async with session.get(url, timeout=30) as resp:
+            async with session.get(url) as resp:
                 resp.raise_for_status()
-                raw_text = await resp.text()
-                if raw_text.strip().startswith("<"):
-                    print(f"Error: content from {url} is HTML. Skipping.", file=sys.stderr)
+                # Work on the raw bytes: no charset sniffing, and the Base64 decode
+                # skips a str -> ASCII round trip
+                raw = await resp.read()
+                # Only the head matters; stripping the whole body would copy it
+                if raw[:64].lstrip().startswith(b"<"):
+                    logger.error("content from %s is HTML. Skipping.", url)
                     return []
-                try:
-                    decoded = base64.b64decode(raw_text).decode("utf-8", errors="ignore")
-                except Exception:
-                    decoded = raw_text
-                
-                lines = [line.strip() for line in decoded.splitlines() if line.strip()]
-                parsed_batch = [p for p in (self.parser.parse(line) for line in lines) if p]
-                print(f"  Found {len(parsed_batch)} servers from {url}.")
+                # Decoding and parsing a large dump is CPU-bound; keep it off the event
+                # loop so the other fetches keep making progress
+                if len(raw) > self.PARSE_OFFLOAD_BYTES:
+                    parsed_batch = await asyncio.to_thread(self._parse_subscription, raw)
+                else:
+                    parsed_batch = self._parse_subscription(raw)
+                logger.info("  Found %s servers from %s.", len(parsed_batch), url)
                 return parsed_batch
         except Exception as e:
-            print(f"Failed to fetch {url}: {e}", file=sys.stderr)
+            logger.error("Failed to fetch %s: %s", url, e)
             return []
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=8, ttl_dns_cache=600, use_dns_cache=True)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=30), trust_env=False
+            )
+        return self._session
+
     async def fetch_subscription_servers(self) -> List[Dict]:
-        print("Fetching subscriptions...")
-        tasks = []
-        async with aiohttp.ClientSession(trust_env=False) as session:
-            for url in self.settings.SUB_URLS:
-                tasks.append(self._fetch_single_url(session, url))
-            
-            results = await asyncio.gather(*tasks)
-        
-        # Flatten and Deduplicate
-        seen_fingerprints = {}
+        logger.info("Fetching subscriptions...")
+        # Blank entries are dropped before any task is scheduled for them
+        urls = [stripped for url in self.settings.SUB_URLS if (stripped := url.strip())]
+        if not urls:
+            return []
+        # Bound the fan-out so a long SUB_URLS list doesn't open everything at once
+        semaphore = asyncio.Semaphore(max(1, min(len(urls), (os.cpu_count() or 1) * 4)))
+
+        async def fetch(session: aiohttp.ClientSession, url: str) -> List[Dict]:
+            async with semaphore:
+                return await self._fetch_single_url(session, url)
+
+        session = self._get_session()
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(fetch(session, url)) for url in urls]
+        results = [task.result() for task in tasks]
+
+        # Flatten and Deduplicate. Byte-identical URIs (mirrored feeds) are caught by
+        # the cheap raw_uri set before the fingerprint is computed.
+        seen_uris = set()
+        seen_fingerprints = set()
+        final_list = []
         total_found = 0
         for batch in results:
             total_found += len(batch)
             for server in batch:
+                uri = server.get("raw_uri")
+                if uri in seen_uris:
+                    continue
+                seen_uris.add(uri)
                 fp = self._generate_fingerprint(server)
                 if fp not in seen_fingerprints:
-                    seen_fingerprints[fp] = server
-        
-        final_list = list(seen_fingerprints.values())
-        print(f"Total servers found: {total_found}. Unique servers: {len(final_list)}")
+                    seen_fingerprints.add(fp)
+                    final_list.append(server)
+
+        logger.info("Total servers found: %s. Unique servers: %s", total_found, len(final_list))
 
         if self.settings.LOW_INTERNET_CONS:
-            print(f"Low Internet Consumption Mode ON: Limiting to top {self.settings.LOW_INTERNET_LIMIT} servers.")
+            logger.info("Low Internet Consumption Mode ON: Limiting to top %s servers.", self.settings.LOW_INTERNET_LIMIT)
             final_list = final_list[:self.settings.LOW_INTERNET_LIMIT]
 
         return final_list
 
     async def compute_top_servers(self) -> List[Dict]:
+        top_servers, _ = await self._test_servers()
+        return top_servers
+
+    async def _test_servers(self, site_urls: Sequence[str] = ()) -> Tuple[List[Dict], Dict[str, List[Dict]]]:
+        """
+        Tests and enriches the fetched servers. site_urls are checked in the same
+        Xray processes as the latency test; returns the top servers and, for each
+        site, the top servers that reached it (in delay order).
+        """
         if not os.path.exists(self.settings.XRAY_PATH):
              # This might happen if Xray is not installed yet or path is wrong
-             print(f"Warning: Xray executable not found at {self.settings.XRAY_PATH}", file=sys.stderr)
+             logger.warning("Xray executable not found at %s", self.settings.XRAY_PATH)
              
         servers = await self.fetch_subscription_servers()
         if not servers:
-            return []
-
-        all_results = []
-        for i in range(0, len(servers), self.settings.BATCH_SIZE):
-            batch = servers[i : i + self.settings.BATCH_SIZE]
-            print(f"Testing batch {i // self.settings.BATCH_SIZE + 1}...")
-            batch_results = await self.xray_service.run_test_batch(batch)
-            all_results.extend(batch_results)
-
-        successful = sorted([(s, d) for s, d in all_results if d <= self.settings.MAX_DELAY_MS], key=lambda item: item[1])
-        print(f"Found {len(successful)} working servers.")
+            return [], {url: [] for url in site_urls}
+
+        all_results = await self.xray_service.test_servers(servers, site_urls)
+
+        max_delay = self.settings.MAX_DELAY_MS
+        working = (r for r in all_results if r[1] <= max_delay)
+        by_delay = operator.itemgetter(1)
+        if self.settings.CACHE_TOP_N > 0:
+            successful = heapq.nsmallest(self.settings.CACHE_TOP_N, working, key=by_delay)
+        else:
+            successful = sorted(working, key=by_delay)
+        logger.info("Found %s working servers.", len(successful))
         
-        enriched_servers = []
-        for server, delay in successful:
-            s_copy = server.copy()
-            s_copy["delay"] = round(delay)
-            
-            # GeoIP Lookup
-            ip = s_copy.get("address")
-            country_code, flag = self.geoip_service.get_country(ip)
-            s_copy["country_code"] = country_code
-            s_copy["flag"] = flag
-            
-            # Update Remark: "🇺🇸 US 78ms"
-            new_remark = f"{flag} {country_code} {s_copy['delay']}ms"
-            s_copy["remark"] = new_remark
-            
-            # Regenerate URI
-            s_copy["raw_uri"] = UriGenerator.generate(s_copy)
-            
-            enriched_servers.append(s_copy)
-
-        return enriched_servers
+        # GeoIP Lookup, once per unique address. Hostnames are resolved first
+        # since the mmdb only knows IPs.
+        addresses = [server.get("address") for server, _, _ in successful]
+        resolved = await self.geoip_service.resolve_bulk(addresses)
+        countries = self.geoip_service.get_countries_bulk([resolved.get(a, a) for a in addresses])
+
+        # Update Remark: "🇺🇸 US 78ms"
+        enriched_servers = [
+            {**server, "delay": (ms := round(delay)), "country_code": country_code, "flag": flag,
+             "remark": f"{flag} {country_code} {ms}ms"}
+            for (server, delay, _), (country_code, flag) in zip(successful, countries)
+        ]
+        # Regenerate URI from the updated remark
+        for server in enriched_servers:
+            server["raw_uri"] = UriGenerator.generate(server)
+
+        site_servers = {
+            url: [server for server, (_, _, sites) in zip(enriched_servers, successful) if sites[k]]
+            for k, url in enumerate(site_urls)
+        }
+        return enriched_servers, site_servers
 
     async def update_cache(self):
         """Updates the cache with the top servers."""
         if self._processing_lock.locked():
-            print("Skipping update, a test is already in progress.")
+            logger.info("Skipping update, a test is already in progress.")
             return
             
         async with self._processing_lock:
             try:
-                top_servers = await self.compute_top_servers()
+                # Pre-check sites ride on the latency test's Xray processes
+                top_servers, site_servers = await self._test_servers(self.settings.PRECHECK_SITES)
                 async with self._cache_lock:
-                    self._cached_all = top_servers
-                    self._cached_top25 = top_servers[:25]
-                print(f"Cache updated with {len(top_servers)} servers.")
+                    self._set_cache(top_servers)
+                    content = self._cached_all_raw
+                logger.info("Cache updated with %s servers.", len(top_servers))
 
                 # Persist to Redis
-                await self.storage_service.save_servers("working_servers", top_servers)
+                await self.storage_service.save_servers_hash("working_servers", top_servers, self._generate_fingerprint)
 
-                await self._handle_github_push(top_servers)
-                await self._handle_precheck_sites(top_servers)
+                await self._handle_github_push(top_servers, content)
+                await self._handle_precheck_sites(top_servers, site_servers)
 
             except Exception as e:
-                print(f"Error during cache update: {e}", file=sys.stderr)
+                logger.error("Error during cache update: %s", e)
 
-    async def _handle_github_push(self, top_servers: List[Dict]):
+    def _get_uploader(self) -> GitUploader:
+        if self._uploader is None:
+            self._uploader = GitUploader(
+                repo_url=self.settings.GITHUB_REPO_URL,
+                token=self.settings.GITHUB_TOKEN,
+                user_name=self.settings.GITHUB_USER,
+                user_email=self.settings.GITHUB_EMAIL,
+                repo_dir=self.settings.GITHUB_REPO_DIR,
+                branch=self.settings.GITHUB_BRANCH
+            )
+        return self._uploader
+
+    async def _handle_github_push(self, top_servers: List[Dict], content: bytes):
         if self.settings.GITHUB_PUSH_ENABLED and self.settings.GITHUB_TOKEN and self.settings.GITHUB_REPO_URL and top_servers:
-            print("Starting GitHub push for main subscription...")
+            logger.info("Starting GitHub push for main subscription...")
             try:
-                raw_links = [s["raw_uri"] for s in top_servers]
-                content = "\n".join(raw_links)
-                
-                uploader = GitUploader(
-                    repo_url=self.settings.GITHUB_REPO_URL,
-                    token=self.settings.GITHUB_TOKEN,
-                    user_name=self.settings.GITHUB_USER,
-                    user_email=self.settings.GITHUB_EMAIL,
-                    repo_dir=self.settings.GITHUB_REPO_DIR,
-                    branch=self.settings.GITHUB_BRANCH
-                )
+                uploader = self._get_uploader()
                 await asyncio.to_thread(uploader.update_file_and_push, self.settings.GITHUB_FILENAME, content)
             except Exception as e:
-                print(f"Main GitHub push failed: {e}", file=sys.stderr)
+                logger.error("Main GitHub push failed: %s", e)
 
-    async def _handle_precheck_sites(self, top_servers: List[Dict]):
+    async def _handle_precheck_sites(self, top_servers: List[Dict], site_servers: Dict[str, List[Dict]]):
         if self.settings.PRECHECK_SITES and top_servers:
-            print(f"Pre-warming site cache for: {self.settings.PRECHECK_SITES}")
-            for site_url in self.settings.PRECHECK_SITES:
-                print(f"  Pre-checking {site_url}...")
-                try:
-                    valid_servers = await self.xray_service.evaluate_site_accessibility(site_url, top_servers)
-                    
-                    async with self._site_cache_lock:
-                        self._site_cache[site_url] = (time.time(), valid_servers)
-                    print(f"  Cached {len(valid_servers)} servers for {site_url}")
-
-                    if self.settings.GITHUB_PUSH_ENABLED and valid_servers:
-                        await self._push_site_specific_list(site_url, valid_servers)
-
-                except Exception as e:
-                    print(f"  Failed to pre-check {site_url}: {e}", file=sys.stderr)
+            logger.info("Pre-warming site cache for: %s", self.settings.PRECHECK_SITES)
+            for site_url, valid_servers in site_servers.items():
+                async with self._site_cache_lock:
+                    self._site_cache[site_url] = (time.time(), valid_servers)
+                logger.info("  Cached %s servers for %s", len(valid_servers), site_url)
+
+                if self.settings.GITHUB_PUSH_ENABLED and valid_servers:
+                    await self._push_site_specific_list(site_url, valid_servers)
 
     async def _push_site_specific_list(self, site_url: str, valid_servers: List[Dict]):
         try:
@@ -233,59 +334,60 @@ class SubscriptionService:
             safe_hostname = parsed.hostname.replace(".", "_") if parsed.hostname else "unknown_site"
             site_filename = f"{safe_hostname}.txt"
 
-            site_content = "\n".join([s["raw_uri"] for s in valid_servers])
+            site_content = self.join_raw_uris(valid_servers)
             
-            uploader = GitUploader(
-                repo_url=self.settings.GITHUB_REPO_URL,
-                token=self.settings.GITHUB_TOKEN,
-                user_name=self.settings.GITHUB_USER,
-                user_email=self.settings.GITHUB_EMAIL,
-                repo_dir=self.settings.GITHUB_REPO_DIR,
-                branch=self.settings.GITHUB_BRANCH
-            )
-            print(f"  Pushing {site_filename} to GitHub...")
+            uploader = self._get_uploader()
+            logger.info("  Pushing %s to GitHub...", site_filename)
             await asyncio.to_thread(uploader.update_file_and_push, site_filename, site_content)
         except Exception as push_err:
-            print(f"  Failed to push file for {site_url}: {push_err}", file=sys.stderr)
+            logger.error("  Failed to push file for %s: %s", site_url, push_err)
 
     async def start_periodic_update(self):
+        # Opens the GeoIP reader once; every lookup afterwards reuses it
         await self.geoip_service.initialize()
         await self.storage_service.initialize()
         
         # Try to load from cache first
-        cached = await self.storage_service.load_servers("working_servers")
+        cached = await self.storage_service.load_servers_hash("working_servers")
         if cached:
+             # Hash values come back unordered
+             cached.sort(key=lambda s: s.get("delay", 0))
              async with self._cache_lock:
-                 self._cached_all = cached
-                 self._cached_top25 = cached[:25]
-             print(f"Loaded {len(cached)} servers from persistent storage.")
+                 self._set_cache(cached)
+             logger.info("Loaded %s servers from persistent storage.", len(cached))
 
         while True:
-            print("Periodic cache update started...")
+            logger.info("Periodic cache update started...")
             await self.update_cache()
             await asyncio.sleep(self.settings.CACHE_INTERVAL_SECONDS)
 
     # Accessors
     async def get_top_25(self) -> List[Dict]:
-        async with self._cache_lock:
-            return self._cached_top25
+        return self._cached_top25
 
     async def get_all_cached(self) -> List[Dict]:
-        async with self._cache_lock:
-            return self._cached_all
+        return self._cached_all
+
+    async def get_top_25_raw(self) -> Optional[bytes]:
+        return self._cached_raw
+
+    async def get_top_25_base64(self) -> Optional[bytes]:
+        return self._cached_b64
+
+    async def get_all_base64(self) -> Optional[bytes]:
+        return self._cached_all_b64
     
     async def get_site_specific_servers(self, url: str) -> List[Dict]:
         # Check cache
-        async with self._site_cache_lock:
-            if url in self._site_cache:
-                cache_time, cached_servers = self._site_cache[url]
-                if (time.time() - cache_time) < self.settings.SITE_CACHE_TTL_SECONDS:
-                    return cached_servers
+        entry = self._site_cache.get(url)
+        if entry is not None:
+            cache_time, cached_servers = entry
+            if (time.time() - cache_time) < self.settings.SITE_CACHE_TTL_SECONDS:
+                return cached_servers
 
         # If not cached or expired, we need to test
         # We need the base list of servers to test against
-        async with self._cache_lock:
-             servers_to_test = self._cached_all
+        servers_to_test = self._cached_all
 
         if not servers_to_test:
             return None
@@ -302,4 +404,11 @@ class SubscriptionService:
         return successful_servers
 
     def is_processing(self) -> bool:
-        return self._processing_lock.locked()
\ No newline at end of file
+        return self._processing_lock.locked()
+
+    async def close(self):
+        """Releases the HTTP session, the GeoIP reader and the Redis connection."""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        await self.geoip_service.aclose()
+        await self.storage_service.close()
@@ -1,7 +1,36 @@
-import base64
-import json
+import functools
+from typing import Any, Tuple
 from urllib.parse import quote, urlencode
 
+import orjson
+import pybase64
+
+# Only the remark (delay, country) changes between refresh cycles, so the part
+# of each URI before "#" is cached on its connection fields
+_PREFIX_CACHE_SIZE = 4096
+
+# Query parameters in the order they're emitted; missing or falsy ones are left out
+_VLESS_QUERY = ("encryption", "security", "type", "host", "path", "sni", "flow", "fp", "pbk", "sid")
+_TROJAN_QUERY = ("security", "sni", "type", "flow", "path", "host")
+_HY2_QUERY = ("sni", "obfs", "obfs-password", "insecure")
+
+# Remarks repeat heavily ("🇺🇸 US 78ms"), so their quoting is memoized too
+_quote_remark = functools.lru_cache(maxsize=_PREFIX_CACHE_SIZE)(quote)
+
+
+@functools.lru_cache(maxsize=_PREFIX_CACHE_SIZE, typed=True)
+def _query_prefix(scheme: str, user: Any, host: Any, port: Any, names: Tuple[str, ...], values: Tuple[Any, ...]) -> str:
+    query = urlencode({name: value for name, value in zip(names, values) if value})
+    return f"{scheme}://{user}@{host}:{port}?{query}"
+
+
+@functools.lru_cache(maxsize=_PREFIX_CACHE_SIZE, typed=True)
+def _ss_prefix(method: Any, password: Any, host: Any, port: Any) -> str:
+    user_info = f"{method}:{password}"
+    user_info_b64 = pybase64.urlsafe_b64encode(user_info.encode()).decode().strip('=')
+    return f"ss://{user_info_b64}@{host}:{port}"
+
+
 class UriGenerator:
     """
     Helper class to regenerate proxy URIs from server dictionaries.
@@ -27,29 +56,11 @@ class UriGenerator:
     @staticmethod
     def _generate_vless(s: dict) -> str:
         # vless://uuid@host:port?params#remark
-        user = s.get("vless_id", "")
-        host = s.get("address", "")
-        port = s.get("port", "")
-        
-        params = {}
-        if s.get("encryption"): params["encryption"] = s["encryption"]
-        if s.get("security"): params["security"] = s["security"]
-        if s.get("type"): params["type"] = s["type"]
-        if s.get("host"): params["host"] = s["host"]
-        if s.get("path"): params["path"] = s["path"]
-        if s.get("sni"): params["sni"] = s["sni"]
-        if s.get("flow"): params["flow"] = s["flow"]
-        if s.get("fp"): params["fp"] = s["fp"]
-        if s.get("pbk"): params["pbk"] = s["pbk"]
-        if s.get("sid"): params["sid"] = s["sid"]
-        
-        # Filter None values
-        params = {k: v for k, v in params.items() if v is not None}
-        
-        query = urlencode(params)
-        remark = quote(s.get("remark", ""))
-        
-        return f"vless://{user}@{host}:{port}?{query}#{remark}"
+        prefix = _query_prefix(
+            "vless", s.get("vless_id", ""), s.get("address", ""), s.get("port", ""),
+            _VLESS_QUERY, tuple(map(s.get, _VLESS_QUERY)),
+        )
+        return f"{prefix}#{_quote_remark(s.get('remark', ''))}"
 
     @staticmethod
     def _generate_vmess(s: dict) -> str:
@@ -73,60 +84,30 @@ class UriGenerator:
         # Clean up keys that might be None
         data = {k: v for k, v in data.items() if v is not None}
         
-        json_str = json.dumps(data, separators=(',', ':'))
-        b64_encoded = base64.b64encode(json_str.encode()).decode()
+        # orjson emits compact JSON as UTF-8 bytes, ready for Base64
+        b64_encoded = pybase64.b64encode(orjson.dumps(data)).decode()
         return f"vmess://{b64_encoded}"
 
     @staticmethod
     def _generate_trojan(s: dict) -> str:
         # trojan://password@host:port?params#remark
-        password = s.get("password", "")
-        host = s.get("address", "")
-        port = s.get("port", "")
-        
-        params = {}
-        if s.get("security"): params["security"] = s["security"]
-        if s.get("sni"): params["sni"] = s["sni"]
-        if s.get("type"): params["type"] = s["type"]
-        if s.get("flow"): params["flow"] = s["flow"]
-        if s.get("path"): params["path"] = s["path"]
-        if s.get("host"): params["host"] = s["host"]
-        
-        params = {k: v for k, v in params.items() if v is not None}
-        query = urlencode(params)
-        remark = quote(s.get("remark", ""))
-        
-        return f"trojan://{password}@{host}:{port}?{query}#{remark}"
+        prefix = _query_prefix(
+            "trojan", s.get("password", ""), s.get("address", ""), s.get("port", ""),
+            _TROJAN_QUERY, tuple(map(s.get, _TROJAN_QUERY)),
+        )
+        return f"{prefix}#{_quote_remark(s.get('remark', ''))}"
 
     @staticmethod
     def _generate_ss(s: dict) -> str:
         # ss://base64(method:password)@host:port#remark
-        method = s.get("method", "")
-        password = s.get("password", "")
-        host = s.get("address", "")
-        port = s.get("port", "")
-        
-        user_info = f"{method}:{password}"
-        user_info_b64 = base64.urlsafe_b64encode(user_info.encode()).decode().strip('=')
-        
-        remark = quote(s.get("remark", ""))
-        return f"ss://{user_info_b64}@{host}:{port}#{remark}"
+        prefix = _ss_prefix(s.get("method", ""), s.get("password", ""), s.get("address", ""), s.get("port", ""))
+        return f"{prefix}#{_quote_remark(s.get('remark', ''))}"
 
     @staticmethod
     def _generate_hy2(s: dict) -> str:
         # hy2://auth@host:port?params#remark
-        auth = s.get("password", "")
-        host = s.get("address", "")
-        port = s.get("port", "")
-        
-        params = {}
-        if s.get("sni"): params["sni"] = s["sni"]
-        if s.get("obfs"): params["obfs"] = s["obfs"]
-        if s.get("obfs_password"): params["obfs-password"] = s["obfs_password"]
-        if s.get("insecure"): params["insecure"] = "1"
-        
-        params = {k: v for k, v in params.items() if v is not None}
-        query = urlencode(params)
-        remark = quote(s.get("remark", ""))
-        
-        return f"hy2://{auth}@{host}:{port}?{query}#{remark}"
+        values = (s.get("sni"), s.get("obfs"), s.get("obfs_password"), "1" if s.get("insecure") else None)
+        prefix = _query_prefix(
+            "hy2", s.get("password", ""), s.get("address", ""), s.get("port", ""), _HY2_QUERY, values
+        )
+        return f"{prefix}#{_quote_remark(s.get('remark', ''))}"
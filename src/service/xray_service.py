@@ -1,19 +1,26 @@
 import asyncio
-import json
+import contextlib
+import logging
 import os
-import sys
 import tempfile
 import time
-from typing import Any, Dict, List, Tuple
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
 
 import aiohttp
+import orjson
 from aiohttp_socks import ProxyConnector
 
 from core.config import Settings
 
+logger = logging.getLogger(__name__)
+
 class XrayService:
+    PORT_PROBE_CONCURRENCY = 64
+
     def __init__(self, settings: Settings):
         self.settings = settings
+        # Shared by every batch, so concurrent batches don't multiply the burst
+        self._probe_semaphore = asyncio.Semaphore(max(1, settings.MAX_CONCURRENT_PROBES))
 
     def build_xray_config_for_batch(self, servers: List[Dict[str, Any]], base_port: int) -> Dict[str, Any]:
         inbounds, outbounds, routing_rules = [], [], []
@@ -114,63 +121,101 @@ class XrayService:
         return {"log": {"loglevel": "warning"}, "inbounds": inbounds, "outbounds": outbounds, "routing": {"rules": routing_rules}}
 
 
+    @staticmethod
+    def _write_config(xray_config: Dict[str, Any]) -> str:
+        """Writes the config to a temp file and returns its path; the caller removes it."""
+        # Serializing and writing a full 500-server batch takes about a millisecond,
+        # less than a round trip through the thread pool
+        data = orjson.dumps(xray_config)
+        fd, config_path = tempfile.mkstemp(suffix=".json")
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        return config_path
+
     async def _wait_for_ports(self, ports: List[int], timeout: float = 5.0) -> bool:
-        """Waits until the first port is listening, indicating Xray has started."""
+        """Waits until every port is listening, so no probe fires before its inbound is up."""
         if not ports: return True
-        
-        start_time = time.time()
-        port = ports[0]
-        while time.time() - start_time < timeout:
-            try:
-                # Try to connect to the port
-                reader, writer = await asyncio.open_connection('127.0.0.1', port)
-                writer.close()
-                await writer.wait_closed()
-                return True
-            except (ConnectionRefusedError, OSError):
-                await asyncio.sleep(0.1)
-        return False
-
-    async def test_server_real_delay(self, port: int) -> float:
+
+        # Bounded so a 500-port batch doesn't hold hundreds of sockets at once
+        semaphore = asyncio.Semaphore(self.PORT_PROBE_CONCURRENCY)
+
+        async def probe(port: int):
+            async with semaphore:
+                while True:
+                    try:
+                        # Try to connect to the port
+                        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                        writer.close()
+                        await writer.wait_closed()
+                        return
+                    except (ConnectionRefusedError, OSError):
+                        await asyncio.sleep(0.05)
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(probe(port) for port in ports)), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _bounded(self, probe: Awaitable):
+        # Too many simultaneous probes saturate the host and time out spuriously
+        async with self._probe_semaphore:
+            return await probe
+
+    def _proxy_session(self, port: int) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(connector=ProxyConnector.from_url(f"socks5://127.0.0.1:{port}"))
+
+    async def test_server_real_delay(self, port: int, session: Optional[aiohttp.ClientSession] = None) -> float:
         """Tests latency by making a request through the local SOCKS5 proxy."""
-        proxy_url = f"socks5://127.0.0.1:{port}"
         try:
-            connector = ProxyConnector.from_url(proxy_url)
-            async with aiohttp.ClientSession(connector=connector) as proxy_session:
-                start_time = time.monotonic()
-                async with proxy_session.head(self.settings.LATENCY_TEST_URL, timeout=self.settings.TEST_TIMEOUT) as response:
-                    if 200 <= response.status < 300:
-                        return (time.monotonic() - start_time) * 1000
-                    return float("inf")
+            if session is None:
+                async with self._proxy_session(port) as proxy_session:
+                    return await self.test_server_real_delay(port, proxy_session)
+
+            start_time = time.monotonic()
+            async with session.head(self.settings.LATENCY_TEST_URL, timeout=aiohttp.ClientTimeout(total=self.settings.TEST_TIMEOUT)) as response:
+                if 200 <= response.status < 300:
+                    return (time.monotonic() - start_time) * 1000
+                return float("inf")
         except Exception:
             return float("inf")
 
 
-    async def check_url_via_proxy(self, port: int, target_url: str) -> bool:
+    async def check_url_via_proxy(self, port: int, target_url: str, session: Optional[aiohttp.ClientSession] = None) -> bool:
         """Checks if a target URL is accessible via a SOCKS5 proxy, returning True on success."""
-        proxy = f"socks5://127.0.0.1:{port}"
         try:
-            connector = ProxyConnector.from_url(proxy)
-            timeout = aiohttp.ClientTimeout(total=self.settings.TEST_TIMEOUT)
-            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-                async with session.head(target_url, allow_redirects=True, timeout=self.settings.TEST_TIMEOUT) as response:
-                    return response.status < 400
+            if session is None:
+                async with self._proxy_session(port) as proxy_session:
+                    return await self.check_url_via_proxy(port, target_url, proxy_session)
+
+            async with session.head(target_url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=self.settings.TEST_TIMEOUT)) as response:
+                return response.status < 400
         except Exception:
             return False
 
 
-    async def run_test_batch(self, servers: List[Dict[str, Any]]) -> List[Tuple[Dict, float]]:
+    async def run_multi_probe(
+        self, servers: List[Dict[str, Any]], base_port: int, site_urls: Sequence[str] = ()
+    ) -> List[Tuple[Dict, float, Tuple[bool, ...]]]:
+        """
+        Starts one Xray process for the batch and runs the latency test and, for
+        servers within MAX_DELAY_MS, a check of every site in site_urls through it.
+        Returns (server, delay, per-site results) for each server.
+        """
         if not servers:
             return []
 
-        xray_config = self.build_xray_config_for_batch(servers, self.settings.BASE_PORT)
-        tmp = tempfile.NamedTemporaryFile(mode="w+", delete=False, suffix=".json", encoding="utf-8")
-        await asyncio.to_thread(json.dump, xray_config, tmp)
-        await asyncio.to_thread(tmp.close)
-        config_path = tmp.name
+        no_sites = (False,) * len(site_urls)
+        failed = [(s, float("inf"), no_sites) for s in servers]
 
+        config_path = None
         process = None
         try:
+            # Inside the try so a server that can't be serialized only fails its own batch
+            config_path = self._write_config(self.build_xray_config_for_batch(servers, base_port))
+
             env = os.environ.copy()
             if os.path.isdir(self.settings.XRAY_ASSETS_PATH):
                 env["XRAY_LOCATION_ASSET"] = self.settings.XRAY_ASSETS_PATH
@@ -181,35 +226,52 @@ class XrayService:
             )
             
             # Smart polling: wait for Xray ports to be ready
-            ports = [self.settings.BASE_PORT + i for i in range(len(servers))]
+            ports = [base_port + i for i in range(len(servers))]
             # Increased timeout to 10s to allow for heavier configs/slower systems
             if not await self._wait_for_ports(ports, timeout=10.0):
-                print(f"Xray timed out waiting for ports to open.", file=sys.stderr)
+                logger.error("Xray timed out waiting for ports to open.")
                 if process.returncode is None:
                      process.terminate()
                 stdout, stderr = await process.communicate()
-                print(f"Stdout: {stdout.decode()}", file=sys.stderr)
-                print(f"Stderr: {stderr.decode()}", file=sys.stderr)
-                return [(s, float("inf")) for s in servers]
+                logger.error("Stdout: %s", stdout.decode())
+                logger.error("Stderr: %s", stderr.decode())
+                return failed
 
             if process.returncode is not None:
                 stdout_data = await process.stdout.read()
                 stderr_data = await process.stderr.read()
-                print(f"Xray process failed to start.", file=sys.stderr)
-                print(f"Stdout: {stdout_data.decode()}", file=sys.stderr)
-                print(f"Stderr: {stderr_data.decode()}", file=sys.stderr)
-                return [(s, float("inf")) for s in servers]
+                logger.error("Xray process failed to start.")
+                logger.error("Stdout: %s", stdout_data.decode())
+                logger.error("Stderr: %s", stderr_data.decode())
+                return failed
 
-            tasks = [self.test_server_real_delay(self.settings.BASE_PORT + i) for i, _ in enumerate(servers)]
-            results = await asyncio.gather(*tasks)
-            return list(zip(servers, results))
+            async with contextlib.AsyncExitStack() as stack:
+                # One session per inbound, shared by the latency and site probes
+                sessions = [await stack.enter_async_context(self._proxy_session(port)) for port in ports]
+
+                tasks = [self._bounded(self.test_server_real_delay(port, session)) for port, session in zip(ports, sessions)]
+                delays = await asyncio.gather(*tasks)
+
+                site_results = [no_sites] * len(servers)
+                if site_urls:
+                    alive = [i for i, delay in enumerate(delays) if delay <= self.settings.MAX_DELAY_MS]
+                    tasks = [
+                        self._bounded(self.check_url_via_proxy(ports[i], url, sessions[i]))
+                        for i in alive for url in site_urls
+                    ]
+                    flags = await asyncio.gather(*tasks)
+                    per_site = len(site_urls)
+                    for n, i in enumerate(alive):
+                        site_results[i] = tuple(flags[n * per_site:(n + 1) * per_site])
+
+            return list(zip(servers, delays, site_results))
 
         except FileNotFoundError:
-            print(f"Error: Xray not found at '{self.settings.XRAY_PATH}'.", file=sys.stderr)
-            return [(s, float("inf")) for s in servers]
+            logger.error("Xray not found at '%s'.", self.settings.XRAY_PATH)
+            return failed
         except Exception as e:
-            print(f"An error occurred during batch testing: {e}", file=sys.stderr)
-            return [(s, float("inf")) for s in servers]
+            logger.error("An error occurred during batch testing: %s", e)
+            return failed
         finally:
             if process and process.returncode is None:
                 try:
@@ -218,62 +280,98 @@ class XrayService:
                 except asyncio.TimeoutError:
                     process.kill()
                 await process.wait()
-            if os.path.exists(config_path):
+            if config_path and os.path.exists(config_path):
                 await asyncio.to_thread(os.remove, config_path)
     
+    async def _run_batches(self, servers: List[Dict[str, Any]], run_batch: Callable[[int, List[Dict[str, Any]], int], Awaitable[List]]) -> List:
+        """
+        Runs run_batch(index, batch, base_port) over BATCH_SIZE chunks, at most
+        BATCH_CONCURRENCY at a time, and concatenates the results in batch order.
+        """
+        batch_size = self.settings.BATCH_SIZE
+        # Each running batch holds one slot, i.e. its own port range above BASE_PORT,
+        # so concurrent Xray processes never bind the same inbound ports
+        slots: asyncio.Queue = asyncio.Queue()
+        for slot in range(max(1, self.settings.BATCH_CONCURRENCY)):
+            slots.put_nowait(slot)
+
+        async def run(index: int, batch: List[Dict[str, Any]]) -> List:
+            slot = await slots.get()
+            try:
+                return await run_batch(index, batch, self.settings.BASE_PORT + slot * batch_size)
+            finally:
+                slots.put_nowait(slot)
+
+        batches = [servers[i : i + batch_size] for i in range(0, len(servers), batch_size)]
+        # A failing batch cancels the rest, whose cleanup stops their Xray processes
+        # before the error reaches the caller (and it releases its processing lock)
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(run(index, batch)) for index, batch in enumerate(batches)]
+        return [item for task in tasks for item in task.result()]
+
+    async def test_servers(
+        self, servers: List[Dict[str, Any]], site_urls: Sequence[str] = ()
+    ) -> List[Tuple[Dict, float, Tuple[bool, ...]]]:
+        """
+        Measures the real delay of every server, batching them across Xray processes,
+        and checks site_urls through the same processes (see run_multi_probe).
+        """
+        async def run_batch(index: int, batch: List[Dict[str, Any]], base_port: int) -> List[Tuple[Dict, float, Tuple[bool, ...]]]:
+            logger.info("Testing batch %s...", index + 1)
+            return await self.run_multi_probe(batch, base_port, site_urls)
+
+        return await self._run_batches(servers, run_batch)
+
     async def evaluate_site_accessibility(self, url: str, servers_to_test: List[Dict]) -> List[Dict]:
         """Helper to test a list of servers against a specific URL."""
-        successful_servers = []
-        
-        for i in range(0, len(servers_to_test), self.settings.BATCH_SIZE):
-            batch = servers_to_test[i : i + self.settings.BATCH_SIZE]
-            print(f"Testing batch {i // self.settings.BATCH_SIZE + 1} for site: {url}")
-
-            xray_config = self.build_xray_config_for_batch(batch, self.settings.BASE_PORT)
-            tmp = tempfile.NamedTemporaryFile(mode="w+", delete=False, suffix=".json", encoding="utf-8")
-            await asyncio.to_thread(json.dump, xray_config, tmp)
-            await asyncio.to_thread(tmp.close)
-            config_path = tmp.name
-
-            process = None
-            try:
-                env = os.environ.copy()
-                if os.path.isdir(self.settings.XRAY_ASSETS_PATH):
-                    env["XRAY_LOCATION_ASSET"] = self.settings.XRAY_ASSETS_PATH
-
-                process = await asyncio.create_subprocess_exec(
-                    self.settings.XRAY_PATH, "-c", config_path,
-                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env
-                )
-                
-                # Smart polling: wait for Xray ports to be ready
-                ports = [self.settings.BASE_PORT + j for j in range(len(batch))]
-                await self._wait_for_ports(ports, timeout=3.0)
+        async def run_batch(index: int, batch: List[Dict], base_port: int) -> List[Dict]:
+            logger.info("Testing batch %s for site: %s", index + 1, url)
+            return await self._check_site_batch(url, batch, base_port)
+
+        return await self._run_batches(servers_to_test, run_batch)
 
-                if process.returncode is not None:
-                    stdout_data = await process.stdout.read()
-                    stderr_data = await process.stderr.read()
-                    print(f"Xray process (site check) failed to start.", file=sys.stderr)
-                    print(f"Stdout: {stdout_data.decode()}", file=sys.stderr)
-                    print(f"Stderr: {stderr_data.decode()}", file=sys.stderr)
-                    continue
+    async def _check_site_batch(self, url: str, batch: List[Dict], base_port: int) -> List[Dict]:
+        try:
+            config_path = self._write_config(self.build_xray_config_for_batch(batch, base_port))
+        except Exception as e:
+            logger.error("Could not write Xray config for site check batch: %s", e)
+            return []
 
-                tasks = [self.check_url_via_proxy(self.settings.BASE_PORT + j, url) for j, _ in enumerate(batch)]
-                results = await asyncio.gather(*tasks)
+        process = None
+        try:
+            env = os.environ.copy()
+            if os.path.isdir(self.settings.XRAY_ASSETS_PATH):
+                env["XRAY_LOCATION_ASSET"] = self.settings.XRAY_ASSETS_PATH
 
-                for server, was_successful in zip(batch, results):
-                    if was_successful:
-                        successful_servers.append(server)
+            process = await asyncio.create_subprocess_exec(
+                self.settings.XRAY_PATH, "-c", config_path,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env
+            )
+            
+            # Smart polling: wait for Xray ports to be ready
+            ports = [base_port + j for j in range(len(batch))]
+            await self._wait_for_ports(ports, timeout=3.0)
 
-            finally:
-                if process and process.returncode is None:
-                    try:
-                        process.terminate()
-                        await asyncio.wait_for(process.wait(), timeout=2)
-                    except asyncio.TimeoutError:
-                        process.kill()
-                    await process.wait()
-                if os.path.exists(config_path):
-                    await asyncio.to_thread(os.remove, config_path)
-        
-        return successful_servers
+            if process.returncode is not None:
+                stdout_data = await process.stdout.read()
+                stderr_data = await process.stderr.read()
+                logger.error("Xray process (site check) failed to start.")
+                logger.error("Stdout: %s", stdout_data.decode())
+                logger.error("Stderr: %s", stderr_data.decode())
+                return []
+
+            tasks = [self._bounded(self.check_url_via_proxy(base_port + j, url)) for j, _ in enumerate(batch)]
+            results = await asyncio.gather(*tasks)
+
+            return [server for server, was_successful in zip(batch, results) if was_successful]
+
+        finally:
+            if process and process.returncode is None:
+                try:
+                    process.terminate()
+                    await asyncio.wait_for(process.wait(), timeout=2)
+                except asyncio.TimeoutError:
+                    process.kill()
+                await process.wait()
+            if os.path.exists(config_path):
+                await asyncio.to_thread(os.remove, config_path)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Make the packages under src/ (core, models, service) importable from the tests.
+# Only pytest loads this; plain unittest runs need PYTHONPATH=src (see README).
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
@@ -1,94 +1,135 @@
-import sys
-import os
+import base64
+import json
 import unittest
 
-# Add src to path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
-
 from service.parse_uri import ProxyParser
 
+# vmess requires a JSON blob in base64
+_VMESS_DATA = {
+    "v": "2",
+    "ps": "VMess",
+    "add": "example.com",
+    "port": "443",
+    "id": "uuid",
+    "aid": "0",
+    "scy": "auto",
+    "net": "ws",
+    "type": "none",
+    "host": "example.com",
+    "path": "/path",
+    "tls": "tls",
+    "sni": "example.com",
+    "alpn": ""
+}
+VMESS_URI = "vmess://" + base64.b64encode(json.dumps(_VMESS_DATA, separators=(",", ":")).encode()).decode()
+
+# base64 decode of chacha20-ietf-poly1305:password is Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwYXNzd29yZA==
+SS_URI = "ss://Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwYXNzd29yZA==@example.com:8388#Shadowsocks"
+
+# (uri, expected fields) for each supported protocol
+CASES = [
+    (
+        "vless://uuid@example.com:443?security=reality&sni=example.com&fp=chrome&pbk=publickey&sid=shortid&type=tcp&flow=xtls-rprx-vision#Example",
+        {
+            'protocol': 'vless',
+            'address': 'example.com',
+            'port': 443,
+            'vless_id': 'uuid',
+            'security': 'reality',
+            'remark': 'Example',
+        },
+    ),
+    (
+        "trojan://password@example.com:443?security=tls&sni=example.com&type=tcp#Trojan",
+        {
+            'protocol': 'trojan',
+            'address': 'example.com',
+            'port': 443,
+            'password': 'password',
+            'remark': 'Trojan',
+        },
+    ),
+    (
+        SS_URI,
+        {
+            'protocol': 'shadowsocks',
+            'address': 'example.com',
+            'port': 8388,
+            'method': 'chacha20-ietf-poly1305',
+            'password': 'password',
+            'remark': 'Shadowsocks',
+        },
+    ),
+    (
+        VMESS_URI,
+        {
+            'protocol': 'vmess',
+            'remark': 'VMess',
+            'address': 'example.com',
+            'port': 443,
+            'vmess_id': 'uuid',
+        },
+    ),
+    (
+        "hy2://freehomesvpnchannel3@channel2.saghetalaie.homes:46914/?insecure=1&sni=www.google.com&obfs=salamander&obfs-password=%26O%2328YB5qK%215t%23U#TestHy2",
+        {
+            'protocol': 'hysteria2',
+            'address': 'channel2.saghetalaie.homes',
+            'port': 46914,
+            'password': 'freehomesvpnchannel3',
+            'sni': 'www.google.com',
+            'insecure': True,
+            'obfs': 'salamander',
+            'obfs_password': '&O#28YB5qK!5t#U',
+            'remark': 'TestHy2',
+        },
+    ),
+]
+
 class TestProxyParser(unittest.TestCase):
-    def setUp(self):
-        self.parser = ProxyParser()
+    @classmethod
+    def setUpClass(cls):
+        # The parser is stateless, so one instance serves every test
+        cls.parser = ProxyParser()
 
-    def test_parse_vless(self):
-        uri = "vless://uuid@example.com:443?security=reality&sni=example.com&fp=chrome&pbk=publickey&sid=shortid&type=tcp&flow=xtls-rprx-vision#Example"
-        result = self.parser.parse(uri)
-        self.assertIsNotNone(result)
-        self.assertEqual(result['protocol'], 'vless')
-        self.assertEqual(result['address'], 'example.com')
-        self.assertEqual(result['port'], 443)
-        self.assertEqual(result['vless_id'], 'uuid')
-        self.assertEqual(result['security'], 'reality')
-        self.assertEqual(result['remark'], 'Example')
+    def test_parse(self):
+        for uri, expected in CASES:
+            with self.subTest(protocol=expected['protocol']):
+                result = self.parser.parse(uri)
+                self.assertIsNotNone(result)
+                self.assertEqual({key: result[key] for key in expected}, expected)
 
-    def test_parse_trojan(self):
-        uri = "trojan://password@example.com:443?security=tls&sni=example.com&type=tcp#Trojan"
+    def test_parse_vless_encoded_params(self):
+        uri = "vless://uuid@[2001:DB8::1]:8443?type=ws&path=%2Fws%3Fed%3D2048&host=&sni=a.com&sni=b.com#Enc"
         result = self.parser.parse(uri)
         self.assertIsNotNone(result)
-        self.assertEqual(result['protocol'], 'trojan')
-        self.assertEqual(result['address'], 'example.com')
-        self.assertEqual(result['port'], 443)
-        self.assertEqual(result['password'], 'password')
-        self.assertEqual(result['remark'], 'Trojan')
+        self.assertEqual(result['address'], '2001:db8::1')
+        self.assertEqual(result['port'], 8443)
+        self.assertEqual(result['path'], '/ws?ed=2048')
+        self.assertIsNone(result['host'])
+        self.assertEqual(result['sni'], 'a.com')
+        self.assertIsNone(self.parser.parse("vless://uuid@example.com:99999?type=tcp"))
 
-    def test_parse_ss(self):
-        # ss://Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwYXNzd29yZA==@example.com:8388#Shadowsocks
-        # base64 decode of chacha20-ietf-poly1305:password is Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwYXNzd29yZA==
-        uri = "ss://Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwYXNzd29yZA==@example.com:8388#Shadowsocks"
-        result = self.parser.parse(uri)
-        self.assertIsNotNone(result)
-        self.assertEqual(result['protocol'], 'shadowsocks')
-        self.assertEqual(result['address'], 'example.com')
-        self.assertEqual(result['port'], 8388)
-        self.assertEqual(result['method'], 'chacha20-ietf-poly1305')
-        self.assertEqual(result['password'], 'password')
-        self.assertEqual(result['remark'], 'Shadowsocks')
+    def test_parse_vmess_port_out_of_range(self):
+        payload = json.dumps({"add": "h.com", "port": "99999999999999999999", "id": "u"}).encode()
+        self.assertIsNone(self.parser.parse("vmess://" + base64.b64encode(payload).decode()))
 
-    def test_parse_vmess(self):
-        # vmess requires a JSON blob in base64. 
-        import base64
-        import json
-        vmess_data = {
-            "v": "2",
-            "ps": "VMess",
-            "add": "example.com",
-            "port": "443",
-            "id": "uuid",
-            "aid": "0",
-            "scy": "auto",
-            "net": "ws",
-            "type": "none",
-            "host": "example.com",
-            "path": "/path",
-            "tls": "tls",
-            "sni": "example.com",
-            "alpn": ""
-        }
-        vmess_b64 = base64.b64encode(json.dumps(vmess_data).encode()).decode()
-        uri = f"vmess://{vmess_b64}"
-        
-        result = self.parser.parse(uri)
-        self.assertIsNotNone(result)
-        self.assertEqual(result['protocol'], 'vmess')
-        self.assertEqual(result['remark'], 'VMess')
-        self.assertEqual(result['address'], 'example.com')
-        self.assertEqual(result['port'], 443)
-        self.assertEqual(result['vmess_id'], 'uuid')
+    def test_parse_ss_port_out_of_range(self):
+        uri = "ss://Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwYXNzd29yZA@example.com:99999999999999999999#S"
+        self.assertIsNone(self.parser.parse(uri))
 
-    def test_parse_hy2(self):
-        uri = "hy2://freehomesvpnchannel3@channel2.saghetalaie.homes:46914/?insecure=1&sni=www.google.com&obfs=salamander&obfs-password=%26O%2328YB5qK%215t%23U#TestHy2"
-        result = self.parser.parse(uri)
-        self.assertIsNotNone(result)
-        self.assertEqual(result['protocol'], 'hysteria2')
-        self.assertEqual(result['address'], 'channel2.saghetalaie.homes')
-        self.assertEqual(result['port'], 46914)
-        self.assertEqual(result['password'], 'freehomesvpnchannel3')
-        self.assertEqual(result['sni'], 'www.google.com')
-        self.assertTrue(result['insecure'])
-        self.assertEqual(result['obfs'], 'salamander')
-        self.assertEqual(result['obfs_password'], '&O#28YB5qK!5t#U')
-        self.assertEqual(result['remark'], 'TestHy2')
+    def test_parse_returns_independent_copies(self):
+        uri = "trojan://password@example.com:443?security=tls#Cached"
+        first = self.parser.parse(uri)
+        first['remark'] = 'changed'
+        second = self.parser.parse(uri)
+        self.assertEqual(second['remark'], 'Cached')
+        self.assertIsNot(first, second)
+
+    def test_parse_unsupported_scheme(self):
+        self.assertIsNone(self.parser.parse("ssr://c29tZWRhdGE="))
+        self.assertIsNone(self.parser.parse("socks://example.com:1080"))
+        self.assertIsNone(self.parser.parse("not a uri"))
 
 if __name__ == '__main__':
     unittest.main()
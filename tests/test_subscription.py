@@ -0,0 +1,48 @@
+import base64
+import unittest
+
+from core.config import Settings
+from service.subscription_service import SubscriptionService
+from service.xray_service import XrayService
+
+URIS = [
+    "trojan://password@example.com:443?security=tls&sni=example.com&type=tcp#Trojan",
+    "vless://uuid@example.com:443?security=reality&sni=example.com&type=tcp#Example",
+    "hy2://auth@example.org:8443/?insecure=1&sni=www.google.com#Hy2",
+]
+PLAIN = "\n".join(URIS).encode()
+
+
+class TestParseSubscription(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        settings = Settings()
+        cls.service = SubscriptionService(settings, XrayService(settings))
+
+    def assertParsesAll(self, body: bytes):
+        servers = self.service._parse_subscription(body)
+        self.assertEqual([s['raw_uri'] for s in servers], URIS)
+
+    def test_plaintext(self):
+        self.assertParsesAll(PLAIN)
+        self.assertParsesAll(PLAIN + b"\r\n\n")
+
+    def test_padded_base64(self):
+        encoded = base64.b64encode(PLAIN)
+        self.assertTrue(encoded.endswith(b"="))
+        self.assertParsesAll(encoded + b"\n")
+
+    def test_unpadded_base64(self):
+        self.assertParsesAll(base64.b64encode(PLAIN).rstrip(b"="))
+
+    def test_line_wrapped_base64(self):
+        # Line breaks must not count towards the padding; these widths leave 1-4 of them
+        encoded = base64.b64encode(PLAIN)
+        for body in (encoded, encoded.rstrip(b"=")):
+            for width in (64, 76, 100, 150):
+                with self.subTest(padded=body is encoded, width=width):
+                    wrapped = b"\n".join(body[i:i + width] for i in range(0, len(body), width))
+                    self.assertParsesAll(wrapped + b"\n")
+
+if __name__ == '__main__':
+    unittest.main()
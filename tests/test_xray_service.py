@@ -0,0 +1,36 @@
+import asyncio
+import unittest
+
+from core.config import Settings
+from service.parse_uri import ProxyParser
+from service.xray_service import XrayService
+
+# The parser rejects such ports, but server dicts also come from the Redis cache
+BAD_SERVER = {
+    "protocol": "shadowsocks",
+    "address": "example.com",
+    "port": 99999999999999999999,
+    "method": "chacha20-ietf-poly1305",
+    "password": "password",
+    "raw_uri": "ss://bad",
+}
+
+
+class TestUnserializableBatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Batches must fail before Xray is ever started
+        cls.service = XrayService(Settings(XRAY_PATH="/nonexistent/xray"))
+        cls.good = ProxyParser().parse("trojan://password@example.com:443?security=tls#Trojan")
+
+    def test_latency_batch_fails_alone(self):
+        results = asyncio.run(self.service.test_servers([BAD_SERVER, self.good], ["https://example.com"]))
+        self.assertEqual([server for server, _, _ in results], [BAD_SERVER, self.good])
+        self.assertTrue(all(delay == float("inf") for _, delay, _ in results))
+        self.assertTrue(all(sites == (False,) for _, _, sites in results))
+
+    def test_site_batch_fails_alone(self):
+        self.assertEqual(asyncio.run(self.service.evaluate_site_accessibility("https://example.com", [BAD_SERVER])), [])
+
+if __name__ == '__main__':
+    unittest.main()